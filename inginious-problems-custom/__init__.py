@@ -8,9 +8,10 @@ import json
 import re
 import sys
 import gettext
+from functools import lru_cache
+from types import MappingProxyType
 
 from flask import send_from_directory
-from abc import ABCMeta, abstractmethod
 
 from inginious.common.base import id_checker
 from inginious.common.tasks_problems import Problem
@@ -23,128 +24,54 @@ __version__ = "0.1.dev0"
 
 PATH_TO_PLUGIN = os.path.abspath(os.path.dirname(__file__))
 PATH_TO_TEMPLATES = os.path.join(PATH_TO_PLUGIN, "templates")
+PATH_TO_STATIC = os.path.join(PATH_TO_PLUGIN, "static")
 
+_LANG_RE = re.compile(r'[a-z0-9\-_\.]+\Z', re.IGNORECASE)
+_NULL_TRANSLATIONS = gettext.NullTranslations()  # stateless, safe to share between all text boxes
 
-class StaticMockPage(INGIniousPage):
-    def GET(self, path):
-        return send_from_directory(os.path.join(PATH_TO_PLUGIN, "static"), path)
 
-    def POST(self, path):
-        return self.GET(path)
+@lru_cache(maxsize=4096)
+def _check_id(boxid):
+    """ Cached id_checker. Empty box ids are accepted here, callers that forbid them check it themselves """
+    return boxid == "" or id_checker(boxid)
 
-class CustomProblem(Problem):
-    """Basic problem with code input. Do all the job with the backend"""
 
-    def __init__(self, problemid, content, translations, taskfs):
-        Problem.__init__(self, problemid, content, translations, taskfs)
-        self._boxes = []
-        self._box_types = {"input-text": InputBox, "input-decimal": InputBox, "input-integer": InputBox,
-                           "multiline": MultilineBox, "text": TextBox, "file": FileBox}
-
-        self._init_boxes(content)
-
-    def get_boxes(self):
-        """ Returns all the boxes of this code problem """
-        return self._boxes
-
-    @classmethod
-    def get_type(cls):
-        return "custom"
-
-    def input_is_consistent(self, task_input, default_allowed_extension, default_max_size):
-        for box in self._boxes:
-            if not box.input_is_consistent(task_input, default_allowed_extension, default_max_size):
-                return False
+def _is_integer(value):
+    """ Returns True if value can be parsed as an integer """
+    # plain digit strings are always valid integers, only parse the other ones
+    if isinstance(value, str) and value.isdecimal():
         return True
+    try:
+        int(value)
+    except (TypeError, ValueError):
+        return False
+    return True
 
-    def input_type(self):
-        return str
-
-    def _init_boxes(self, content):
-        if "boxes" in content:
-            self._boxes = []
-            for boxid, box_content in content['boxes'].items():
-                if boxid == "":
-                    raise Exception("Empty box ids are not allowed")
-                self._boxes.append(self._create_box(boxid, box_content))
 
-    def _create_box(self, boxid, box_content):
-        """ Create adequate box """
-        if not id_checker(boxid) and not boxid == "":
-            raise Exception("Invalid box _id " + boxid)
-        if "type" not in box_content:
-            raise Exception("Box " + boxid + " does not have a type")
-        if box_content["type"] not in self._box_types:
-            raise Exception("Unknown box type " + box_content["type"] + " for box _id " + boxid)
-
-        return self._box_types[box_content["type"]](self, boxid, box_content)
+def _is_decimal(value):
+    """ Returns True if value can be parsed as a decimal number """
+    try:
+        float(value)
+    except (TypeError, ValueError):
+        return False
+    return True
 
-    def check_answer(self, _, __):
-        return None, None, None, 0, ""
 
-    @classmethod
-    def parse_problem(self, problem_content):
-        problem_content = Problem.parse_problem(problem_content)
-        try:
-            problem_content["boxes"] = json.loads(problem_content["boxes"], object_pairs_hook=OrderedDict)
-        except:
-            raise Exception("Invalid JSON in boxes content")
-
-        return problem_content
-
-    @classmethod
-    def get_text_fields(cls):
-        return Problem.get_text_fields()
-
-
-
-class DisplayableCustomProblem(CustomProblem, DisplayableProblem):
-    """ A displayable match problem """
-
-    def __init__(self, problemid, content, translations, taskfs):
-        Problem.__init__(self, problemid, content, translations, taskfs)
-        self._boxes = []
-        self._box_types = {
-            "input-text": DisplayableInputBox,
-            "input-decimal": DisplayableInputBox,
-            "input-integer": DisplayableInputBox,
-            "multiline": DisplayableMultilineBox,
-            "text": DisplayableTextBox,
-            "file": DisplayableFileBox}
-        self._init_boxes(content)
-
-    @classmethod
-    def get_type_name(cls, language):
-        return "custom"
-
-    def adapt_input_for_backend(self, input_data):
-        for box in self._boxes:
-            input_data = box.adapt_input_for_backend(input_data)
-        return input_data
-
-    def show_input(self, template_helper, language, seed):
-        """ Show BasicCodeProblem and derivatives """
-        output = ""
-        for box in self._boxes:
-            output += box.show(template_helper, language)
-        return output
-
-    @classmethod
-    def show_editbox(cls, template_helper, key, language):
-        return template_helper.render("custom_edit.html", template_folder=PATH_TO_TEMPLATES, key=key)
-
-    @classmethod
-    def show_editbox_templates(cls, template_helper, key, language):
-        return ""
+class StaticMockPage(INGIniousPage):
+    def GET(self, path):
+        return send_from_directory(PATH_TO_STATIC, path)
 
+    def POST(self, path):
+        return self.GET(path)
 
-class BasicBox(object, metaclass=ABCMeta):
+class BasicBox(object):
     """ A basic abstract problem box. A box is a small input for a problem. A problem can contain multiple boxes """
 
-    @abstractmethod
+    __slots__ = ("_id", "_problem", "_complete_id")
+
     def get_type(self):
         """ Return the type of this box """
-        return None
+        raise NotImplementedError
 
     def get_problem(self):
         """ Return the problem to which this box is linked """
@@ -156,31 +83,30 @@ class BasicBox(object, metaclass=ABCMeta):
 
     def input_is_consistent(self, task_input, default_allowed_extension, default_max_size):  # pylint: disable=unused-argument
         """ Check if an input for this box is consistent. Return true if this is case, false else """
-        try:
-            return self.get_complete_id() in task_input
-        except:
-            return False
+        return self._complete_id in task_input
 
     def get_complete_id(self):
         """ Returns the complete _id of this box. This _id is unique among all problems and boxes in an exercice """
-        pid = str(self.get_problem().get_id())
-        bid = str(self.get_id())
-        if bid != "":
-            return pid + "/" + bid
-        else:
-            return pid
+        return self._complete_id
 
     def __init__(self, problem, boxid, boxdata_):
         """ Constructor. problem is a BasicProblem (or derivated) instance, boxid a an alphanumeric _id and boxdata is the data for this box. """
-        if not id_checker(boxid) and not boxid == "":
+        if not _check_id(boxid):
             raise Exception("Invalid box _id: " + boxid)
         self._id = boxid
         self._problem = problem
 
+        # problem and box ids never change, so the complete id is built (and interned) only once
+        pid = str(problem.get_id())
+        bid = str(boxid)
+        self._complete_id = sys.intern(pid + "/" + bid if bid != "" else pid)
+
 
 class TextBox(BasicBox):
     """Text box. Simply shows text."""
 
+    __slots__ = ("_content",)
+
     def get_type(self):
         return "text"
 
@@ -208,77 +134,78 @@ class FileBox(BasicBox):
 
     """
 
+    __slots__ = ("_allowed_exts", "_max_size", "_allowed_exts_tuple")
+
     def get_type(self):
         return "file"
 
     def input_is_consistent(self, taskInput, default_allowed_extension, default_max_size):
-        if not BasicBox.input_is_consistent(self, taskInput, default_allowed_extension, default_max_size):
+        value = taskInput.get(self._complete_id)
+        if not isinstance(value, dict):
             return False
 
-        try:
-            if not taskInput[self.get_complete_id()]["filename"].endswith(tuple(self._allowed_exts or default_allowed_extension)):
-                return False
+        filename = value.get("filename")
+        if not isinstance(filename, str) or not filename.endswith(self._allowed_exts_tuple or tuple(default_allowed_extension)):
+            return False
 
-            if sys.getsizeof(taskInput[self.get_complete_id()]["value"]) > (self._max_size or default_max_size):
-                return False
-        except:
+        content = value.get("value")
+        if isinstance(content, str):
+            # file contents are normally bytes, only text payloads sent as str are encoded here
+            content = content.encode("utf-8", "surrogatepass")
+        if not isinstance(content, (bytes, bytearray)) or len(content) > (self._max_size or default_max_size):
             return False
         return True
 
     def __init__(self, problem, boxid, boxData):
         super(FileBox, self).__init__(problem, boxid, boxData)
         self._allowed_exts = boxData.get("allowed_exts", None)
+        self._allowed_exts_tuple = tuple(self._allowed_exts) if self._allowed_exts else None
         self._max_size = boxData.get("max_size", None)
 
 
 class InputBox(BasicBox):
     """ Input box. Displays an input object """
 
+    __slots__ = ("_input_type", "_default_value", "_optional", "_max_chars", "_checks")
+
+    _TYPE_MAP = {"input-text": ("text", ""), "input-integer": ("integer", "0"), "input-decimal": ("decimal", "0.0")}
+
     def get_type(self):
         return "input"
 
     def input_is_consistent(self, taskInput, default_allowed_extension, default_max_size):
-        if not BasicBox.input_is_consistent(self, taskInput, default_allowed_extension, default_max_size):
-            return False
-
-        if self._max_chars != 0 and len(taskInput[self.get_complete_id()]) > self._max_chars:
+        cid = self._complete_id
+        value = taskInput.get(cid)
+        if not isinstance(value, str):
             return False
 
         # do not allow empty answers
-        try:
-            if len(taskInput[self.get_complete_id()]) == 0:
-                if self._optional:
-                    taskInput[self.get_complete_id()] = self._default_value
-                else:
-                    return False
-        except:
+        if len(value) == 0:
+            if self._optional:
+                # the default value always passes the checks
+                taskInput[cid] = self._default_value
+                return True
             return False
 
-        if self._input_type == "integer":
-            try:
-                int(taskInput[self.get_complete_id()])
-            except:
-                return False
+        return all(check(value) for check in self._checks)
 
-        if self._input_type == "decimal":
-            try:
-                float(taskInput[self.get_complete_id()])
-            except:
-                return False
-        return True
+    def _build_checks(self):
+        """ Returns the list of checks that apply to the inputs of this box, depending on its parameters """
+        checks = []
+        if self._max_chars != 0:
+            max_chars = self._max_chars
+            checks.append(lambda value: len(value) <= max_chars)
+        if self._input_type == "integer":
+            checks.append(_is_integer)
+        elif self._input_type == "decimal":
+            checks.append(_is_decimal)
+        return checks
 
     def __init__(self, problem, boxid, boxData):
         super(InputBox, self).__init__(problem, boxid, boxData)
-        if boxData["type"] == "input-text":
-            self._input_type = "text"
-            self._default_value = ""
-        elif boxData["type"] == "input-integer":
-            self._input_type = "integer"
-            self._default_value = "0"
-        elif boxData["type"] == "input-decimal":
-            self._input_type = "decimal"
-            self._default_value = "0.0"
-        else:
+        try:
+            self._input_type, self._default_value = self._TYPE_MAP[boxData["type"]]
+        except KeyError:
             raise Exception("No such box type " + boxData["type"] + " in box " + boxid)
 
         self._optional = boxData.get("optional", False)
@@ -290,22 +217,28 @@ class InputBox(BasicBox):
         else:
             self._max_chars = 0
 
+        self._checks = self._build_checks()
+
 
 class MultilineBox(BasicBox):
     """ Multiline Box """
 
+    __slots__ = ("_max_chars", "_optional", "_lines", "_language")
+
     def get_type(self):
         return "multiline"
 
     def input_is_consistent(self, taskInput, default_allowed_extension, default_max_size):
-        if not BasicBox.input_is_consistent(self, taskInput, default_allowed_extension, default_max_size):
+        cid = self._complete_id
+        value = taskInput.get(cid)
+        if not isinstance(value, str):
             return False
-        if self._max_chars != 0 and len(taskInput[self.get_complete_id()]) > self._max_chars:
+        if self._max_chars != 0 and len(value) > self._max_chars:
             return False
         # do not allow empty answers
-        if len(taskInput[self.get_complete_id()]) == 0:
+        if len(value) == 0:
             if self._optional:
-                taskInput[self.get_complete_id()] = ""
+                taskInput[cid] = ""
             else:
                 return False
         return True
@@ -328,7 +261,7 @@ class MultilineBox(BasicBox):
         else:
             self._lines = 8
 
-        if re.match(r'[a-z0-9\-_\.]+$', boxData.get("language", ""), re.IGNORECASE):
+        if _LANG_RE.match(boxData.get("language", "")):
             self._language = boxData.get("language", "")
         elif boxData.get("language", ""):
             raise Exception("Invalid language " + boxData["language"])
@@ -336,9 +269,12 @@ class MultilineBox(BasicBox):
             self._language = "plain"
 
 
-class DisplayableBox(object, metaclass=ABCMeta):
+class DisplayableBox(object):
     """ A basic interface for displayable boxes """
 
+    # empty so that it can be mixed with the slotted box classes
+    __slots__ = ()
+
     def __init__(self, problem, boxid, boxData):
         pass
 
@@ -346,36 +282,39 @@ class DisplayableBox(object, metaclass=ABCMeta):
         """ Adapt the input from web input for the inginious.backend """
         return input_data
 
-    @abstractmethod
     def show(self, renderer, language):
         """ Get the html to show this box """
-        pass
+        raise NotImplementedError
 
 
 class DisplayableTextBox(TextBox, DisplayableBox):
     """ A displayable text box """
 
+    __slots__ = ()
+
     def __init__(self, problem, boxid, boxData):
         super(DisplayableTextBox, self).__init__(problem, boxid, boxData)
 
     def show(self, template_helper, language):
         """ Show TextBox """
         return template_helper.render("box_text.html", template_folder=PATH_TO_TEMPLATES,
-                                      text=ParsableText(self._content, "rst", translation=gettext.NullTranslations()))
+                                      text=ParsableText(self._content, "rst", translation=_NULL_TRANSLATIONS))
 
 
 class DisplayableFileBox(FileBox, DisplayableBox):
     """ A displayable file box """
 
+    __slots__ = ()
+
     def __init__(self, problem, boxid, boxData):
         super(DisplayableFileBox, self).__init__(problem, boxid, boxData)
 
     def adapt_input_for_backend(self, input_data):
+        cid = self._complete_id
         try:
-            input_data[self.get_complete_id()] = {"filename": input_data[self.get_complete_id()].filename,
-                                                  "value": input_data[self.get_complete_id()].value}
+            input_data[cid] = {"filename": input_data[cid].filename, "value": input_data[cid].value}
         except:
-            input_data[self.get_complete_id()] = {}
+            input_data[cid] = {}
         return input_data
 
     def show(self, template_helper, language):
@@ -388,6 +327,8 @@ class DisplayableFileBox(FileBox, DisplayableBox):
 class DisplayableInputBox(InputBox, DisplayableBox):
     """ A displayable input box """
 
+    __slots__ = ()
+
     def __init__(self, problem, boxid, boxData):
         super(DisplayableInputBox, self).__init__(problem, boxid, boxData)
 
@@ -401,6 +342,8 @@ class DisplayableInputBox(InputBox, DisplayableBox):
 class DisplayableMultilineBox(MultilineBox, DisplayableBox):
     """ A displayable multiline box """
 
+    __slots__ = ()
+
     def __init__(self, problem, boxid, boxData):
         super(DisplayableMultilineBox, self).__init__(problem, boxid, boxData)
 
@@ -411,6 +354,105 @@ class DisplayableMultilineBox(MultilineBox, DisplayableBox):
                                       language=self._language, optional=self._optional)
 
 
+class CustomProblem(Problem):
+    """Basic problem with code input. Do all the job with the backend"""
+
+    _BOX_TYPES = MappingProxyType({"input-text": InputBox, "input-decimal": InputBox, "input-integer": InputBox,
+                                   "multiline": MultilineBox, "text": TextBox, "file": FileBox})
+
+    def __init__(self, problemid, content, translations, taskfs):
+        super(CustomProblem, self).__init__(problemid, content, translations, taskfs)
+        self._boxes = []
+        self._init_boxes(content)
+
+    def get_boxes(self):
+        """ Returns all the boxes of this code problem """
+        return self._boxes
+
+    @classmethod
+    def get_type(cls):
+        return "custom"
+
+    def input_is_consistent(self, task_input, default_allowed_extension, default_max_size):
+        for box in self._boxes:
+            if not box.input_is_consistent(task_input, default_allowed_extension, default_max_size):
+                return False
+        return True
+
+    def input_type(self):
+        return str
+
+    def _init_boxes(self, content):
+        if "boxes" in content:
+            if "" in content['boxes']:
+                raise Exception("Empty box ids are not allowed")
+            create_box = self._create_box
+            self._boxes = [create_box(boxid, box_content) for boxid, box_content in content['boxes'].items()]
+
+    def _create_box(self, boxid, box_content):
+        """ Create adequate box """
+        if not _check_id(boxid):
+            raise Exception("Invalid box _id " + boxid)
+        if "type" not in box_content:
+            raise Exception("Box " + boxid + " does not have a type")
+        box_type = self._BOX_TYPES.get(box_content["type"])
+        if box_type is None:
+            raise Exception("Unknown box type " + box_content["type"] + " for box _id " + boxid)
+
+        return box_type(self, boxid, box_content)
+
+    def check_answer(self, _, __):
+        return None, None, None, 0, ""
+
+    @classmethod
+    def parse_problem(self, problem_content):
+        problem_content = Problem.parse_problem(problem_content)
+        try:
+            problem_content["boxes"] = json.loads(problem_content["boxes"], object_pairs_hook=OrderedDict)
+        except (KeyError, TypeError, ValueError):
+            raise Exception("Invalid JSON in boxes content")
+
+        return problem_content
+
+    @classmethod
+    def get_text_fields(cls):
+        return Problem.get_text_fields()
+
+
+
+class DisplayableCustomProblem(CustomProblem, DisplayableProblem):
+    """ A displayable match problem """
+
+    _BOX_TYPES = MappingProxyType({
+        "input-text": DisplayableInputBox,
+        "input-decimal": DisplayableInputBox,
+        "input-integer": DisplayableInputBox,
+        "multiline": DisplayableMultilineBox,
+        "text": DisplayableTextBox,
+        "file": DisplayableFileBox})
+
+    @classmethod
+    def get_type_name(cls, language):
+        return "custom"
+
+    def adapt_input_for_backend(self, input_data):
+        for box in self._boxes:
+            input_data = box.adapt_input_for_backend(input_data)
+        return input_data
+
+    def show_input(self, template_helper, language, seed):
+        """ Show BasicCodeProblem and derivatives """
+        return "".join(box.show(template_helper, language) for box in self._boxes)
+
+    @classmethod
+    def show_editbox(cls, template_helper, key, language):
+        return template_helper.render("custom_edit.html", template_folder=PATH_TO_TEMPLATES, key=key)
+
+    @classmethod
+    def show_editbox_templates(cls, template_helper, key, language):
+        return ""
+
+
 def init(plugin_manager, course_factory, client, plugin_config):
     # TODO: Replace by shared static middleware and let webserver serve the files
     plugin_manager.add_page('/plugins/custom/static/<path:path>', StaticMockPage.as_view("customproblemsstaticpage"))